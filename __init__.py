@@ -16,23 +16,29 @@
 # along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import threading
 
-from aqt.utils import tooltip
+from aqt.utils import showWarning, tooltip
 from aqt.operations import QueryOp
 from aqt.qt import *
 
 from aqt import mw
 
-from anki.hooks import addHook
+from anki.hooks import addHook, field_filter
+from anki.utils import ids2str
 
 from . import reading
-from .config import Config
+from . import template
+from .config import config
 from .selection import Selection
 from .utils import removeFurigana
-from .bulk import bulkGenerate
+from .bulk import BulkProgress, bulkDelete, bulkGenerate
+from .idle import scheduler
 
-mecab = reading.MecabController()
-config = Config()
+mecab = reading.mecab
+mecab.setOverrides(config.getReadingOverrides())
+
+verifyAction = None
 
 
 def setupGuiMenu():
@@ -45,10 +51,41 @@ def setupGuiMenu():
         "Ignore numbers", mw, checkable=True, checked=config.getIgnoreNumbers()
     )
     ignoreNumbers.toggled.connect(config.setIgnoreNumbers)
+    ignoreNumbers.toggled.connect(template.invalidate)
+
+    verify = QAction(
+        "Verify furigana", mw, checkable=True, checked=config.getVerify()
+    )
+    verify.toggled.connect(config.setVerify)
+    verify.toggled.connect(onVerifyToggled)
+    template.setVerifying(config.getVerify())
 
     mw.form.menuTools.addSeparator()
     mw.form.menuTools.addAction(useRubyTags)
     mw.form.menuTools.addAction(ignoreNumbers)
+    mw.form.menuTools.addAction(verify)
+
+    # Kept in step with the config by onConfigUpdated
+    global verifyAction
+    verifyAction = verify
+
+
+def onVerifyToggled(isEnabled):
+    if not isEnabled:
+        tooltip(template.verifier.report())
+    template.setVerifying(isEnabled)
+
+
+def onConfigUpdated(data):
+    config.data = data
+    # Otherwise the next click on the menu item would undo the change
+    verifyAction.blockSignals(True)
+    verifyAction.setChecked(config.getVerify())
+    verifyAction.blockSignals(False)
+    template.setVerifying(config.getVerify())
+    # Cached readings only depend on the overrides among the config values
+    if mecab.setOverrides(config.getReadingOverrides()):
+        template.invalidate()
 
 
 def tooltip_with_shortcut(tip, shortcut_name):
@@ -86,6 +123,8 @@ def addBrowserButtons(browser):
     menu.addSeparator()
     a = menu.addAction('Bulk Generate Furigana')
     a.triggered.connect(lambda _, b=browser: onBulkUpdate(b))
+    a = menu.addAction('Bulk Delete Furigana')
+    a.triggered.connect(lambda _, b=browser: onBulkDelete(b))
 
 def onBulkUpdate(browser):
     nids = browser.selectedNotes()
@@ -96,13 +135,14 @@ def onBulkUpdate(browser):
     bulkUpdate(browser, nids)
 
 def bulkUpdate(browser, nids):
-    config = mw.addonManager.getConfig(__name__)
-    lastSourceField = config.get('lastSourceField', None)
-    lastDestinationField = config.get('lastDestinationField', None)
+    # Legacy single mapping, used as a default for note types without their own
+    lastSourceField = config.data.get('lastSourceField', None)
+    lastDestinationField = config.data.get('lastDestinationField', None)
 
-    # Extract fields from the first note
-    note = mw.col.get_note(nids[0])
-    fields = note.keys()
+    # Group the selected notes by note type
+    groups = mw.col.db.all(
+        "select mid, count() from notes where id in {} group by mid".format(ids2str(nids))
+    )
 
     # Set up dialog
     dialog = QDialog(browser)
@@ -110,30 +150,37 @@ def bulkUpdate(browser, nids):
 
     layout = QVBoxLayout(dialog)
 
-    sourceFieldLayout = QHBoxLayout()
-    layout.addLayout(sourceFieldLayout)
-    sourceFieldLabel = QLabel('Source Field')
-    sourceFieldLayout.addWidget(sourceFieldLabel)
-    sourceField = QComboBox()
-    sourceFieldLayout.addWidget(sourceField)
+    fieldsLayout = QGridLayout()
+    layout.addLayout(fieldsLayout)
+    fieldsLayout.addWidget(QLabel('Source Field'), 0, 1)
+    fieldsLayout.addWidget(QLabel('Destination Field'), 0, 2)
+
+    combos = {}
+    for row, (mid, count) in enumerate(groups, start=1):
+        model = mw.col.models.get(mid)
+        fields = mw.col.models.field_names(model)
+        mapping = config.getFieldMapping(mid) or {
+            'source': lastSourceField,
+            'destination': lastDestinationField,
+        }
 
-    destinationFieldLayout = QHBoxLayout()
-    layout.addLayout(destinationFieldLayout)
-    destinationFieldLabel = QLabel('Destination Field')
-    destinationFieldLayout.addWidget(destinationFieldLabel)
-    destinationField = QComboBox()
+        fieldsLayout.addWidget(QLabel('{} ({} note(s))'.format(model['name'], count)), row, 0)
+        sourceField = QComboBox()
+        fieldsLayout.addWidget(sourceField, row, 1)
+        destinationField = QComboBox()
+        fieldsLayout.addWidget(destinationField, row, 2)
 
-    destinationFieldLayout.addWidget(destinationField)
+        for field in fields:
+            sourceField.addItem(field)
+            destinationField.addItem(field)
 
-    for field in fields:
-        sourceField.addItem(field)
-        destinationField.addItem(field)
+            if field == mapping['source']:
+                sourceField.setCurrentText(field)
 
-        if field == lastSourceField:
-            sourceField.setCurrentText(field)
+            if field == mapping['destination']:
+                destinationField.setCurrentText(field)
 
-        if field == lastDestinationField:
-            destinationField.setCurrentText(field)
+        combos[mid] = (sourceField, destinationField)
 
     buttonsLayout = QHBoxLayout()
     layout.addLayout(buttonsLayout)
@@ -141,34 +188,117 @@ def bulkUpdate(browser, nids):
     buttonsLayout.addWidget(generateButton)
 
     generateButton.clicked.connect(dialog.accept)
-    dialog.resize(320, 150)
+    dialog.resize(480, 100 + 30 * len(groups))
 
     if dialog.exec():
         # Get the values *before* QueryOp otherwise the QT objects will be disposed of
-        sourceField = sourceField.currentText()
-        destinationField = destinationField.currentText()
+        fieldMappings = {
+            mid: (sourceField.currentText(), destinationField.currentText())
+            for mid, (sourceField, destinationField) in combos.items()
+        }
+
+        # Save the values per note type to be remembered later
+        config.setFieldMappings({
+            str(mid): {'source': source, 'destination': destination}
+            for mid, (source, destination) in fieldMappings.items()
+        })
+
+        runBulkOp(
+            'Generating furigana...',
+            nids,
+            lambda col, progress: bulkGenerate(col, nids, fieldMappings, progress),
+            'Furigana generated for {} note(s)',
+        )
+
+def onBulkDelete(browser):
+    nids = browser.selectedNotes()
+    if not nids:
+        tooltip("No notes selected.")
+        return
+
+    bulkDeleteDialog(browser, nids)
+
+def bulkDeleteDialog(browser, nids):
+    lastDeleteFields = config.getDeleteFields()
+
+    # Offer every field of the selected note types, in order of appearance
+    fields = []
+    for mid in mw.col.db.list("select distinct mid from notes where id in {}".format(ids2str(nids))):
+        for field in mw.col.models.field_names(mw.col.models.get(mid)):
+            if field not in fields:
+                fields.append(field)
+
+    # Set up dialog
+    dialog = QDialog(browser)
+    dialog.setWindowTitle('Bulk Delete Furigana for ' + str(len(nids)) + ' note(s)')
+
+    layout = QVBoxLayout(dialog)
+    layout.addWidget(QLabel('Fields'))
+
+    checkBoxes = []
+    for field in fields:
+        checkBox = QCheckBox(field)
+        checkBox.setChecked(field in lastDeleteFields)
+        layout.addWidget(checkBox)
+        checkBoxes.append(checkBox)
+
+    buttonsLayout = QHBoxLayout()
+    layout.addLayout(buttonsLayout)
+    deleteButton = QPushButton('Delete', parent=dialog)
+    buttonsLayout.addWidget(deleteButton)
+
+    deleteButton.clicked.connect(dialog.accept)
+    dialog.resize(320, 100 + 25 * len(fields))
+
+    if dialog.exec():
+        # Get the values *before* QueryOp otherwise the QT objects will be disposed of
+        fieldNames = [checkBox.text() for checkBox in checkBoxes if checkBox.isChecked()]
+        if not fieldNames:
+            tooltip("No fields selected.")
+            return
 
         # Save the values to be remembered later
-        configs = {
-            'lastSourceField': sourceField,
-            'lastDestinationField': destinationField,
-        }
-        mw.addonManager.writeConfig(__name__, configs)
-
-        def progressCallback(i, total):
-            mw.taskman.run_on_main(
-                lambda: mw.progress.update(
-                    label=f"{i}/{total}",
-                    value=i,
-                    max=total,
-                )
-            )
-
-        QueryOp(
-            parent=mw,
-            op=lambda col: bulkGenerate(col, nids, sourceField, destinationField, progressCallback),
-            success=lambda col: tooltip('Furigana generated successfully'),
-        ).with_progress().run_in_background()
+        config.setDeleteFields(fieldNames)
+
+        runBulkOp(
+            'Deleting furigana...',
+            nids,
+            lambda col, progress: bulkDelete(col, nids, fieldNames, progress),
+            'Furigana deleted from {} note(s)',
+        )
+
+def runBulkOp(label, nids, op, successMessage):
+    cancelled = threading.Event()
+
+    def report(progress):
+        # Format in the background, the job may advance while the main thread updates
+        text = progress.label()
+        done = progress.done
+
+        def update():
+            if mw.progress.want_cancel():
+                cancelled.set()
+            mw.progress.update(label=text, value=done, max=len(nids))
+
+        mw.taskman.run_on_main(update)
+
+    def success(progress):
+        scheduler.resume()
+        message = successMessage.format(progress.done)
+        if progress.cancelled:
+            message += ', cancelled before the remaining {}'.format(progress.total - progress.done)
+        tooltip(message)
+
+    def failure(exception):
+        scheduler.resume()
+        showWarning(str(exception))
+
+    scheduler.pause()
+    QueryOp(
+        parent=mw,
+        op=lambda col: op(col, BulkProgress(len(nids), report, cancelled.is_set)),
+        success=success,
+    ).failure(failure).with_progress(label).run_in_background()
 
 def doIt(editor, action):
     Selection(editor, lambda s: action(editor, s))
@@ -177,7 +307,10 @@ def doIt(editor, action):
 def generateFurigana(editor, s):
     html = s.selected
     html = removeFurigana(html)
-    html = mecab.reading(html, config.getIgnoreNumbers(), config.getUseRubyTags())
+    if s.isRange:
+        html = mecab.rangeReading(html, s.previousCharacter, config.getIgnoreNumbers(), config.getUseRubyTags())
+    else:
+        html = mecab.reading(html, config.getIgnoreNumbers(), config.getUseRubyTags())
     if html == s.selected:
         tooltip("Nothing to generate!")
     else:
@@ -193,5 +326,9 @@ def deleteFurigana(editor, s):
 
 
 setupGuiMenu()
+mw.addonManager.setConfigUpdatedAction(__name__, onConfigUpdated)
 addHook("setupEditorButtons", addButtons)
-addHook("browser.setupMenus", addBrowserButtons)
\ No newline at end of file
+addHook("browser.setupMenus", addBrowserButtons)
+addHook("profileLoaded", scheduler.start)
+addHook("unloadProfile", scheduler.stop)
+field_filter.append(template.onFieldFilter)
\ No newline at end of file
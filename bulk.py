@@ -18,30 +18,158 @@
 import time
 
 from . import reading
-from .config import Config
-from .utils import removeFurigana
+from .config import config
+from .utils import formatDuration, removeFurigana
 from aqt import *
 
-mecab = reading.MecabController()
-config = Config()
+from anki.utils import ids2str, split_fields
 
-def bulkGenerate(collection, noteIds, sourceField, destinationField, progress):
-    undo_entry = collection.add_custom_undo_entry('Batch Generate Furigana')
-    last_progress = 0
-    i = 0
+mecab = reading.mecab
 
-    for noteId in noteIds:
-        note = collection.get_note(noteId)
-        note[destinationField] = generateFurigana(note[sourceField])
-        collection.update_note(note)
-        collection.merge_undo_entries(undo_entry)
-        i += 1
+# Number of notes read from the collection at once
+CHUNK_SIZE = 500
 
-        if time.time() - last_progress >= 0.1:
-            progress(i, len(noteIds))
-            last_progress = time.time()
+# Minimum number of seconds between two progress reports
+REPORT_INTERVAL = 0.25
+
+def streamFields(collection, noteIds):
+    # Reads (note id, note type id, fields) straight from the notes table, a chunk
+    # at a time, so that memory use doesn't depend on the number of notes
+    for start in range(0, len(noteIds), CHUNK_SIZE):
+        chunk = noteIds[start:start + CHUNK_SIZE]
+        rows = collection.db.all("select id, mid, flds from notes where id in {}".format(ids2str(chunk)))
+        yield [(nid, mid, split_fields(flds)) for (nid, mid, flds) in rows]
+
+def fieldOrds(collection, mid, names):
+    fieldMap = collection.models.field_map(collection.models.get(mid))
+    if not all(name in fieldMap for name in names):
+        return None
+    return [fieldMap[name][0] for name in names]
+
+class BulkProgress:
+
+    def __init__(self, total, report, shouldCancel):
+        self.total = total
+        self.report = report
+        self.shouldCancel = shouldCancel
+        self.done = 0
+        self.cancelled = False
+        self.tokens = 0
+        self.start = time.monotonic()
+        self.lastReport = 0.0
+
+    def advance(self, notes=1):
+        self.done += notes
+
+        # Reporting goes through the main thread, so keep it to a few times a second
+        now = time.monotonic()
+        if now - self.lastReport >= REPORT_INTERVAL:
+            self.lastReport = now
+            self.report(self)
+
+    def wantCancel(self):
+        self.cancelled = self.cancelled or self.shouldCancel()
+        return self.cancelled
+
+    def elapsed(self):
+        return max(time.monotonic() - self.start, 1e-6)
+
+    def notesPerSecond(self):
+        return self.done / self.elapsed()
+
+    def tokensPerSecond(self):
+        return self.tokens / self.elapsed()
+
+    def eta(self):
+        rate = self.notesPerSecond()
+        return (self.total - self.done) / rate if rate > 0 else None
+
+    def label(self):
+        rate = "{:.0f} notes/s".format(self.notesPerSecond())
+
+        # Jobs which don't run MeCab, like deleting furigana, have no tokens
+        tokensPerSecond = self.tokensPerSecond()
+        if tokensPerSecond > 0:
+            rate += ", {:.0f} tokens/s".format(tokensPerSecond)
+
+        eta = self.eta()
+        return "{}/{} notes\n{}\n{}".format(
+            self.done,
+            self.total,
+            rate,
+            "{} left".format(formatDuration(eta)) if eta is not None and self.done else "Estimating time left...",
+        )
+
+def bulkApply(collection, noteIds, undoLabel, ordsFor, update, progress):
+    # ordsFor(mid) gives whatever update needs to know about a note type, or None
+    # to skip its notes. update(fields, ords) returns the new html by field ord.
+    undo_entry = collection.add_custom_undo_entry(undoLabel)
+    ordsByModel = {}
+
+    for rows in streamFields(collection, noteIds):
+        notes = []
+        for (noteId, mid, fields) in rows:
+            # Stop between notes, the ones already done in this chunk still get written
+            if progress.wantCancel():
+                break
+
+            progress.advance()
+            if mid not in ordsByModel:
+                ordsByModel[mid] = ordsFor(mid)
+
+            ords = ordsByModel[mid]
+            if ords is None:
+                continue
+
+            changes = {ord: html for (ord, html) in update(fields, ords).items() if html != fields[ord]}
+
+            # Only notes which actually change are loaded and written back
+            if changes:
+                note = collection.get_note(noteId)
+                for (ord, html) in changes.items():
+                    note.fields[ord] = html
+                notes.append(note)
+
+        if notes:
+            collection.update_notes(notes)
+            collection.merge_undo_entries(undo_entry)
+
+        if progress.cancelled:
+            break
+
+    return progress
+
+def bulkGenerate(collection, noteIds, fieldMappings, progress):
+    # fieldMappings maps each note type id to its (source, destination) field names
+    def ordsFor(mid):
+        mapping = fieldMappings.get(mid)
+        return fieldOrds(collection, mid, mapping) if mapping else None
+
+    def update(fields, ords):
+        (sourceOrd, destinationOrd) = ords
+        (html, tokens) = generateFuriganaWithCount(fields[sourceOrd])
+        progress.tokens += tokens
+        return {destinationOrd: html}
+
+    return bulkApply(collection, noteIds, 'Batch Generate Furigana', ordsFor, update, progress)
+
+def bulkDelete(collection, noteIds, fieldNames, progress):
+    # Fields missing from a note type are ignored for its notes
+    def ordsFor(mid):
+        fieldMap = collection.models.field_map(collection.models.get(mid))
+        return [fieldMap[name][0] for name in fieldNames if name in fieldMap] or None
+
+    def update(fields, ords):
+        return {ord: removeFurigana(fields[ord]) for ord in ords}
+
+    return bulkApply(collection, noteIds, 'Batch Delete Furigana', ordsFor, update, progress)
+
+def generateFurigana(html, useRubyTags=None):
+    return generateFuriganaWithCount(html, useRubyTags)[0]
+
+def generateFuriganaWithCount(html, useRubyTags=None):
+    if useRubyTags is None:
+        useRubyTags = config.getUseRubyTags()
 
-def generateFurigana(html):
     html = removeFurigana(html)
-    html = mecab.reading(html, config.getIgnoreNumbers(), config.getUseRubyTags())
-    return html
+    return mecab.readingWithCount(html, config.getIgnoreNumbers(), useRubyTags)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+def cacheKey(text: str, ignoreNumbers: bool) -> str:
+    # The setting is part of the key so that a reading generated with the other
+    # setting can never be served. Readings are always rendered as ruby tags.
+    return str(int(ignoreNumbers)) + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+# Two level cache of generated readings: a bounded in-memory LRU in front of a
+# bounded sqlite table that persists between sessions
+class ReadingCache:
+
+    def __init__(self, path: str = ":memory:", memoryEntries: int = 5000, diskEntries: int = 200000):
+        self.memoryEntries = memoryEntries
+        self.diskEntries = diskEntries
+        self.memory: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+        self.inserted = 0
+        # Advanced by every clear, see putMany
+        self.generation = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("pragma journal_mode = wal")
+        self.db.execute("pragma synchronous = normal")
+        self.db.execute("create table if not exists readings (key text primary key, value text not null, used real not null)")
+        self.db.execute("create index if not exists readings_used on readings (used)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                return value
+
+            row = self.db.execute("select value from readings where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            self.db.execute("update readings set used = ? where key = ?", (time.time(), key))
+            self.remember(key, row[0])
+            return row[0]
+
+    def put(self, key: str, value: str, generation: Optional[int] = None) -> None:
+        self.putMany([(key, value)], generation)
+
+    def putMany(self, items: Iterable[Tuple[str, str]], generation: Optional[int] = None) -> None:
+        with self.lock:
+            # Readings generated before the cache was last cleared are stale
+            if generation is not None and generation != self.generation:
+                return
+
+            now = time.time()
+            rows = [(key, value, now) for (key, value) in items]
+            self.db.execute("begin")
+            self.db.executemany("insert or replace into readings (key, value, used) values (?, ?, ?)", rows)
+            self.db.execute("commit")
+            for (key, value, _) in rows:
+                self.remember(key, value)
+
+            self.inserted += len(rows)
+            if self.inserted >= self.diskEntries // 10:
+                self.prune()
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            if key in self.memory:
+                return True
+            return self.db.execute("select 1 from readings where key = ?", (key,)).fetchone() is not None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            self.db.execute("delete from readings")
+            self.inserted = 0
+            self.generation += 1
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("select count() from readings").fetchone()[0]
+
+    # Callers must hold the lock
+
+    def remember(self, key: str, value: str) -> None:
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memoryEntries:
+            self.memory.popitem(last=False)
+
+    def prune(self) -> None:
+        self.inserted = 0
+        self.db.execute(
+            "delete from readings where key in (select key from readings order by used desc limit -1 offset ?)",
+            (self.diskEntries,),
+        )
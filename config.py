@@ -61,3 +61,51 @@ class Config:
 
     def getKeyboardShortcut(self, name):
         return self.data["keyboardShortcut"][name]
+
+    def getCacheMemoryEntries(self):
+        return self.data["cacheMemoryEntries"]
+
+    def getCacheDiskEntries(self):
+        return self.data["cacheDiskEntries"]
+
+    def getPregenerateDays(self):
+        return self.data["pregenerateDays"]
+
+    def getPregenerateIdleSeconds(self):
+        return self.data["pregenerateIdleSeconds"]
+
+    def getPregenerateBatchSize(self):
+        return self.data["pregenerateBatchSize"]
+
+    def getPregenerateCpuBudget(self):
+        return self.data["pregenerateCpuBudget"]
+
+    def getReadingOverrides(self):
+        return self.data["readingOverrides"]
+
+    def getVerify(self):
+        return self.data["verify"]
+
+    @saveMe
+    def setVerify(self, isEnabled):
+        self.data["verify"] = isEnabled[0]
+
+    def getVerifySampleRate(self):
+        return self.data["verifySampleRate"]
+
+    def getFieldMapping(self, mid):
+        return self.data["fieldMappings"].get(str(mid))
+
+    @saveMe
+    def setFieldMappings(self, mappings):
+        self.data["fieldMappings"].update(mappings[0])
+
+    def getDeleteFields(self):
+        return self.data["deleteFields"]
+
+    @saveMe
+    def setDeleteFields(self, names):
+        self.data["deleteFields"] = names[0]
+
+
+config = Config()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from concurrent.futures import Future, wait
+from typing import Iterator, Optional, Tuple
+
+from aqt.qt import *
+from aqt import gui_hooks, mw
+
+from . import bulk
+from . import template
+from .config import config
+
+# Events on the main window which count as the user interacting with Anki. The
+# filter is only installed on the main window so that the rest of the events in
+# the application never reach Python.
+INPUT_EVENTS = frozenset([
+    QEvent.Type.KeyPress,
+    QEvent.Type.MouseButtonPress,
+    QEvent.Type.Wheel,
+    QEvent.Type.TouchBegin,
+    QEvent.Type.WindowActivate,
+])
+
+# How often to look for idle time, and to look again for due cards once
+# everything has been generated
+CHECK_INTERVAL_MS = 1000
+RESCAN_INTERVAL = 600
+
+# How long stop() waits for a batch which is already running
+STOP_TIMEOUT = 5
+
+class IdleScheduler(QObject):
+
+    def __init__(self):
+        super().__init__(mw)
+        self.lastInteraction = time.monotonic()
+        self.lastCursor = None
+        self.interrupted = threading.Event()
+        self.future: Optional[Future] = None
+        self.work: Optional[Iterator[Tuple[str, str]]] = None
+        self.lastScan = 0.0
+        self.nextBatch = 0.0
+        self.paused = 0
+        self.generation = template.cache.generation
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.onTimer)
+
+    def start(self) -> None:
+        if config.getPregenerateDays() <= 0:
+            return
+
+        # Reviews, editing and browsing all go through webview messages, state
+        # changes or collection operations, so these hooks see most interactions
+        # without filtering every event of the application
+        gui_hooks.webview_did_receive_js_message.append(self.onJsMessage)
+        gui_hooks.state_did_change.append(self.onInteraction)
+        gui_hooks.operation_did_execute.append(self.onInteraction)
+        mw.installEventFilter(self)
+        self.timer.start(CHECK_INTERVAL_MS)
+
+    def stop(self) -> None:
+        self.timer.stop()
+        mw.removeEventFilter(self)
+        gui_hooks.webview_did_receive_js_message.remove(self.onJsMessage)
+        gui_hooks.state_did_change.remove(self.onInteraction)
+        gui_hooks.operation_did_execute.remove(self.onInteraction)
+
+        # A running batch stops before touching the collection again, wait for
+        # it so nothing reads the collection while the profile unloads
+        self.interrupted.set()
+        future = self.future
+        self.future = None
+        if future is not None:
+            wait([future], timeout=STOP_TIMEOUT)
+
+        self.work = None
+        self.lastScan = 0.0
+
+    def pause(self) -> None:
+        # Bulk jobs keep pre-generation from competing with them for MeCab
+        self.paused += 1
+        self.interrupted.set()
+
+    def resume(self) -> None:
+        self.paused = max(self.paused - 1, 0)
+
+    def onInteraction(self, *args) -> None:
+        self.lastInteraction = time.monotonic()
+        self.interrupted.set()
+
+    def onJsMessage(self, handled, message, context):
+        self.onInteraction()
+        return handled
+
+    def eventFilter(self, obj, event) -> bool:
+        if event.type() in INPUT_EVENTS:
+            self.onInteraction()
+        return False
+
+    def isIdle(self) -> bool:
+        # The mouse moving anywhere over Anki counts as an interaction
+        cursor = QCursor.pos()
+        if cursor != self.lastCursor:
+            self.lastCursor = cursor
+            self.onInteraction()
+
+        return time.monotonic() - self.lastInteraction >= config.getPregenerateIdleSeconds()
+
+    def onTimer(self) -> None:
+        # Checked first so that moving the mouse also interrupts a running batch
+        idle = self.isIdle()
+        if self.future is not None or self.paused or mw.col is None or not idle:
+            return
+
+        # Everything has to be generated again once the cache was cleared
+        if self.generation != template.cache.generation:
+            self.generation = template.cache.generation
+            self.work = None
+            self.lastScan = 0.0
+
+        now = time.monotonic()
+        if now < self.nextBatch:
+            return
+
+        if self.work is None:
+            if now - self.lastScan < RESCAN_INTERVAL:
+                return
+            self.lastScan = now
+            self.work = self.pendingReadings(mw.col)
+
+        self.interrupted.clear()
+        self.future = mw.taskman.run_in_background(
+            lambda work=self.work: self.runBatch(work),
+            self.onBatchDone,
+        )
+
+    def runBatch(self, work: Iterator[Tuple[str, str]]) -> Tuple[float, bool]:
+        start = time.monotonic()
+        generation = template.cache.generation
+
+        batch = []
+        finished = False
+        while len(batch) < config.getPregenerateBatchSize():
+            # Checked before the collection is read again for the next field
+            if self.interrupted.is_set():
+                break
+
+            item = next(work, None)
+            if item is None:
+                finished = True
+                break
+
+            (key, text) = item
+            batch.append((key, template.renderReading(text)))
+
+        # Dropped if the cache was cleared meanwhile, eg when the overrides changed
+        template.cache.putMany(batch, generation)
+        return (time.monotonic() - start, finished)
+
+    def onBatchDone(self, future) -> None:
+        # Results of a batch which outlived stop() are dropped
+        if future is not self.future:
+            return
+
+        self.future = None
+        try:
+            (elapsed, finished) = future.result()
+        except Exception:
+            self.work = None
+            raise
+
+        if finished:
+            self.work = None
+
+        # Stay within the CPU budget by resting in proportion to the time spent
+        budget = min(max(config.getPregenerateCpuBudget(), 0.01), 1.0)
+        self.nextBatch = time.monotonic() + elapsed * (1 / budget - 1)
+
+    def pendingReadings(self, col) -> Iterator[Tuple[str, str]]:
+        search = "prop:due<={} -is:suspended".format(config.getPregenerateDays())
+        noteIds = col.find_notes(search)
+
+        fieldsByModel = {}
+        for model in col.models.all():
+            fieldMap = col.models.field_map(model)
+            fieldsByModel[model["id"]] = [fieldMap[name][0] for name in template.readingFields(model) if name in fieldMap]
+
+        for rows in bulk.streamFields(col, noteIds):
+            for (_, mid, fields) in rows:
+                for ord in fieldsByModel.get(mid, []):
+                    text = fields[ord]
+                    key = template.readingKey(text)
+                    if text and not template.cache.contains(key):
+                        yield (key, text)
+
+scheduler = IdleScheduler()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+# Marks the end of a surface in the trie, it can't be a character of a surface
+# since every other key has a length of one
+READING = ""
+
+# User supplied readings for surfaces which MeCab gets wrong, eg names or jargon.
+# Surfaces are compiled into a trie once so that looking for an override costs
+# as many steps as the characters matched, no matter how many overrides exist.
+class OverrideTrie:
+
+    def __init__(self, overrides: Mapping[str, str]):
+        self.root: Dict[str, dict] = {}
+        for (surface, reading) in overrides.items():
+            if not surface:
+                continue
+
+            node = self.root
+            for char in surface:
+                node = node.setdefault(char, {})
+            node[READING] = reading
+
+    def __bool__(self) -> bool:
+        return bool(self.root)
+
+    # Replaces runs of MeCab nodes whose surfaces spell an override with a single
+    # node carrying the override's reading. Overrides only apply on node
+    # boundaries and the longest one wins.
+    def apply(self, nodes: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+        if not self.root:
+            yield from nodes
+            return
+
+        nodes = list(nodes)
+        index = 0
+        while index < len(nodes):
+            match = self.match(nodes, index)
+            if match is None:
+                yield nodes[index]
+                index += 1
+                continue
+
+            (end, reading) = match
+            yield ("".join(surface for (surface, _) in nodes[index:end]), reading)
+            index = end
+
+    def match(self, nodes: List[Tuple[str, str]], index: int) -> Optional[Tuple[int, str]]:
+        node = self.root
+        found = None
+        for end in range(index, len(nodes)):
+            for char in nodes[end][0]:
+                node = node.get(char)
+                if node is None:
+                    return found
+            if READING in node:
+                found = (end + 1, node[READING])
+        return found
@@ -20,27 +20,37 @@ import os
 import re
 import subprocess
 import platform
-
-from typing import Any, List, Mapping, Optional, Union
-
-mecabArgs = ['--node-format=%m[%f[7]] ', '--eos-format=\n',
-             '--unk-format=%m[] ']
+import threading
+
+from collections import deque
+from typing import Any, Callable, Deque, List, Mapping, Optional, Tuple
+
+try:
+    from .overrides import OverrideTrie
+    from .tables import KATAKANA_TO_HIRAGANA, KANA_CHARS, KANA_OR_KANJI_RUN, NUMBER_CHARS
+except ImportError:
+    # Imported as a top-level module by the test suite
+    from overrides import OverrideTrie
+    from tables import KATAKANA_TO_HIRAGANA, KANA_CHARS, KANA_OR_KANJI_RUN, NUMBER_CHARS
+
+# Each node is printed as three tab terminated fields: the start and end byte
+# offsets of the surface in the input line and its reading (empty when unknown).
+# Neither offsets nor readings can contain a tab, so the output can be split
+# without ambiguity and surfaces are sliced out of the original text.
+#
+# MeCab splits lines longer than its input buffer and answers each part on its
+# own line, which would put every later answer out of step with its caller, so
+# the buffer is made large enough for any field and longer lines are refused.
+MECAB_BUFFER_SIZE = 1 << 20
+mecabArgs = ['--node-format=%ps\t%pe\t%f[7]\t', '--eos-format=\n',
+             '--unk-format=%ps\t%pe\t\t', '-b', str(MECAB_BUFFER_SIZE)]
+NODE_FIELDS = 3
 
 mecabDir = os.path.join(os.path.dirname(__file__), "support")
 
 HTML_REPLACER = '▦'
 NEWLINE_REPLACER = '▧'
 
-# Unicode character used to replace ASCII Space (0x20) in expression before
-# passing in to MeCab. MeCab separates kanji/reading nodes with ASCII spaces,
-# so without this we wouldn't be able to tell apart a node separator from a
-# space character in the original string.
-# This is unique to ASCII Space (0x20) and does not apply to any other whitespace
-# character (eg CJK Space)
-# Codepoint chosen to be a unicode character unlikely to ever feature in ANY
-# Anki card.
-ASCII_SPACE_TOKEN = u"\U0000FFFF"
-
 def htmlReplace(text):
     pattern = r"(?:<[^<]+?>)"
     matches = re.findall(pattern, text)
@@ -65,43 +75,7 @@ if sys.platform == "win32":
 else:
     si: Optional[Any] = None
 
-# Syllabary utilities
-UNICODE_HIRAGANA_START = 0x3041
-UNICODE_HIRAGANA_END = 0x309F
-UNICODE_KATAKANA_START = 0x30A1
-UNICODE_KATAKANA_END = 0x30FF
-
-UNICODE_MIDDLE_DOT = 0x30FB # '・'
-UNICODE_PROLONGED_SOUND_MARK = 0x30FC # 'ー'
-
-class Translator(Mapping[int, Union[str, int, None]]):
-    def __getitem__(self, key: int) -> Union[str, int, None]:
-        if not isinstance(key, int):
-            # Argument error
-            raise LookupError()
-        
-        if key >= UNICODE_KATAKANA_START and key <= UNICODE_KATAKANA_END:
-            # Some general punctuation is located within the Katakana block
-            # and SHOULDN'T be transformed
-            if key == UNICODE_MIDDLE_DOT or key == UNICODE_PROLONGED_SOUND_MARK:
-                raise LookupError()
-
-            # Regular katakana Unicode block
-            offset = key - UNICODE_KATAKANA_START
-            return UNICODE_HIRAGANA_START + offset
-
-        # Not a character we're converting
-        raise LookupError()
-
-    def __len__(self) -> int:
-        # Exists only to satisfy base type
-        raise NotImplementedError()
-
-    def __iter__(self):
-        # Exists only to satisfy base type
-        raise NotImplementedError()
-
-translator = Translator()
+translator = KATAKANA_TO_HIRAGANA
 
 def convertToHiragana(expr: str) -> str:
     return expr.translate(translator)
@@ -114,17 +88,7 @@ def getAdditionalPossibleReadings(hiragana: str) -> Optional[List[str]]:
     return None
 
 def isKana(char: str) -> bool:
-    code = ord(char)
-
-    # Hiragana
-    if code >= UNICODE_HIRAGANA_START and code <= UNICODE_HIRAGANA_END:
-        return True
-
-    # Katakana
-    if code >= UNICODE_KATAKANA_START and code <= UNICODE_KATAKANA_END:
-        return True
-
-    return False
+    return char in KANA_CHARS
 
 # Mecab
 
@@ -153,6 +117,42 @@ class ReadingNode:
             add_space = previous_character is not None and previous_character != "]"
             return '{}{}[{}]'.format(" " if add_space else "", self.text, self.reading)
 
+class MecabOutputError(Exception):
+    # MeCab answered with output that doesn't describe the line it was given
+    pass
+
+def parseNodes(expr: bytes, output: bytes) -> List[Tuple[str, str]]:
+    fields = output.split(b"\t")
+    # Every field is tab terminated, so a well-formed answer ends with an empty
+    # field and a line with text in it always has at least one node
+    if fields[-1] != b"" or (len(fields) - 1) % NODE_FIELDS != 0 or (expr and len(fields) == 1):
+        raise MecabOutputError("Unexpected MeCab output: {!r}".format(output[:80]))
+
+    nodes: list[Tuple[str, str]] = []
+    position = 0
+    for index in range(0, len(fields) - 1, NODE_FIELDS):
+        try:
+            start = int(fields[index])
+            end = int(fields[index + 1])
+        except ValueError:
+            raise MecabOutputError("Unexpected MeCab offsets: {!r}".format(output[:80]))
+
+        if start < position or end < start or end > len(expr):
+            raise MecabOutputError("MeCab offsets {}-{} don't fit the input".format(start, end))
+
+        # Whitespace skipped by MeCab is kept as it is
+        if start > position:
+            nodes.append((expr[position:start].decode("utf-8", "ignore"), ""))
+
+        surface = expr[start:end].decode("utf-8", "ignore")
+        nodes.append((surface, fields[index + 2].decode("utf-8", "ignore")))
+        position = end
+
+    if position < len(expr):
+        nodes.append((expr[position:].decode("utf-8", "ignore"), ""))
+
+    return nodes
+
 class RegexDefinition:
     def __init__(self, text: str, regexGroupIndex: Optional[int]):
         self.text = text
@@ -162,12 +162,11 @@ def kanjiToRegex(kanji: str):
     regexPieces: list[str] = []
     definitions: list[RegexDefinition] = []
     numCaptureGroups = 0
-    index = 0
-    while index < len(kanji):
+    for piece in KANA_OR_KANJI_RUN.findall(kanji):
         # Hiragana and Katakana characters are inlined into the Regex
-        if isKana(kanji[index]):
+        if piece in KANA_CHARS:
             # The reading variable is ALWAYS in hiragana only
-            hiragana = convertToHiragana(kanji[index])
+            hiragana = convertToHiragana(piece)
 
             additional = getAdditionalPossibleReadings(hiragana)
             if additional:
@@ -179,40 +178,47 @@ def kanjiToRegex(kanji: str):
                 # pathway that's normally/usually reserved for kanji
                 regexPieces.append("(" + "|".join([hiragana] + additional) + ")")
 
-                # Use kanji[index] here to retain original katakana/hiragana
+                # Use piece here to retain original katakana/hiragana
                 # (We convert to hiragana just to match against reading)
-                definitions.append(RegexDefinition(kanji[index], numCaptureGroups))
+                definitions.append(RegexDefinition(piece, numCaptureGroups))
                 numCaptureGroups += 1
             else:
                 regexPieces.append(hiragana)
 
-                # Use kanji[index] here to retain original katakana/hiragana
+                # Use piece here to retain original katakana/hiragana
                 # (We convert to hiragana just to match against reading)
-                definitions.append(RegexDefinition(kanji[index], None))
-
-            # Advance to the next character
-            index += 1
+                definitions.append(RegexDefinition(piece, None))
             continue
 
-        # We have a kanji character, which will become a lazy capture group
-        # in our Regex. First, absorb all sequential kanji characters into a
-        # single capture group
-        captureGroup = ""
-        while index < len(kanji) and not isKana(kanji[index]):
-            captureGroup += kanji[index]
-            index += 1
-
+        # We have a run of sequential kanji characters, which will become a
+        # single lazy capture group in our Regex
         regexPieces.append("(.+?)")
-        definitions.append(RegexDefinition(captureGroup, numCaptureGroups))
+        definitions.append(RegexDefinition(piece, numCaptureGroups))
         numCaptureGroups += 1
 
     return ("^{}$".format(str().join(regexPieces)), definitions)
 
+class PendingRequest:
+    def __init__(self):
+        self.output: Optional[bytes] = None
+
 class MecabController(object):
 
     def __init__(self):
         self.mecab = None
 
+        # MeCab answers lines in the order they were written. Callers queue a
+        # pending request and write their line under the write lock, then
+        # whoever holds the read lock hands each output line to the oldest
+        # pending request. Several requests can be in flight at once and
+        # neither lock is held across a whole round-trip.
+        self.writeLock = threading.Lock()
+        self.readLock = threading.Lock()
+        self.pending: Deque[PendingRequest] = deque()
+
+        self.overrides = OverrideTrie({})
+        self.overrideSource: Mapping[str, str] = {}
+
     def setup(self):
         self.mecabCmd = mungeForPlatform([os.path.join(mecabDir, "mecab")] + mecabArgs + ['-d', mecabDir, '-r', os.path.join(mecabDir, "mecabrc")])
         os.environ['DYLD_LIBRARY_PATH'] = mecabDir
@@ -224,25 +230,86 @@ class MecabController(object):
         if not self.mecab:
             self.setup()
             try:
-                self.mecab = subprocess.Popen(self.mecabCmd, bufsize=-1, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, startupinfo=si)
+                self.mecab = subprocess.Popen(self.mecabCmd, bufsize=-1, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, startupinfo=si)
             except OSError:
                 raise Exception(
                     "Please ensure your Linux system has 64 bit binary support.")
 
-    def reading(self, expr, ignoreNumbers = True, useRubyTags = False):
-        self.ensureOpen()
-        matches, expr = escapeText(expr)
-        expr = expr.replace(" ", ASCII_SPACE_TOKEN)
-        self.mecab.stdin.write(expr.encode("utf-8", "ignore") + b'\n')
-        self.mecab.stdin.flush()
-        expr = self.mecab.stdout.readline().rstrip(b'\r\n').decode('utf-8', "ignore")
-        nodes: list[ReadingNode] = []
-        for node in expr.split(" "):
-            if not node:
-                break
+    def setOverrides(self, overrides: Mapping[str, str]) -> bool:
+        # Only recompile the trie when the overrides actually changed, and tell
+        # the caller whether they did
+        if overrides == self.overrideSource:
+            return False
+
+        self.overrides = OverrideTrie(overrides)
+        self.overrideSource = dict(overrides)
+        return True
+
+    def restart(self, process) -> None:
+        # Once answers are out of step with their callers none of the pending
+        # ones can be trusted. Callers waiting on the old engine read the end
+        # of its output and ask the new one again.
+        with self.writeLock:
+            if self.mecab is process:
+                self.mecab = None
+                self.pending = deque()
+        process.kill()
+        process.wait()
+        process.stdin.close()
+
+    def exchange(self, line: bytes) -> Tuple[Any, bytes]:
+        if len(line) >= MECAB_BUFFER_SIZE:
+            raise ValueError("Text of {} bytes is too long for MeCab".format(len(line)))
+
+        request = PendingRequest()
+        with self.writeLock:
+            self.ensureOpen()
+            (process, pending) = (self.mecab, self.pending)
+            pending.append(request)
+            try:
+                process.stdin.write(line + b'\n')
+                process.stdin.flush()
+            except:
+                pending.remove(request)
+                raise
+
+        while request.output is None:
+            with self.readLock:
+                # Our output may have been read by another caller meanwhile
+                if request.output is not None:
+                    break
+                output = process.stdout.readline()
+                pending.popleft().output = output
+
+        return (process, request.output.rstrip(b'\r\n'))
+
+    def communicate(self, line: bytes, parse: Optional[Callable[[bytes], Any]] = None) -> Any:
+        # parse checks the output against the line and returns what the caller
+        # needs from it. Output that doesn't fit restarts MeCab and the line is
+        # asked once more.
+        for attempt in range(2):
+            (process, output) = self.exchange(line)
+            if parse is None:
+                return output
 
-            (kanji, reading) = re.match(r"(.+)\[(.*)\]", node).groups()
+            try:
+                return parse(output)
+            except MecabOutputError:
+                self.restart(process)
+                if attempt:
+                    raise
+
+    def reading(self, expr, ignoreNumbers = True, useRubyTags = False, previousCharacter = None):
+        return self.readingWithCount(expr, ignoreNumbers, useRubyTags, previousCharacter)[0]
 
+    def readingWithCount(self, expr, ignoreNumbers = True, useRubyTags = False, previousCharacter = None):
+        # Also returns the number of nodes MeCab produced, for throughput reporting
+        matches, expr = escapeText(expr)
+        expr = expr.strip()
+        line = expr.encode("utf-8", "ignore")
+        (parsed, tokens) = self.communicate(line, lambda output: (parseNodes(line, output), output.count(b"\t") // NODE_FIELDS))
+        nodes: list[ReadingNode] = []
+        for (kanji, reading) in self.overrides.apply(parsed):
             # katakana, punctuation, not japanese, or lacking a reading
             # NOTE: Katakana goes down this path because Mecab returns all
             # readings in katakana, so a katakana word looks like 'カリン[カリン]'
@@ -259,7 +326,7 @@ class MecabController(object):
                 continue
 
             # don't add readings of numbers
-            if ignoreNumbers and kanji in u"一二三四五六七八九十０１２３４５６７８９":
+            if ignoreNumbers and kanji in NUMBER_CHARS:
                 nodes.append(ReadingNode(kanji, None))
                 continue
 
@@ -269,6 +336,12 @@ class MecabController(object):
             # are for the kanji
             (regexPattern, regexDefinitions) = kanjiToRegex(kanji)
             match = re.search(regexPattern, reading)
+            if match is None:
+                # The reading doesn't fit the kana of the word (eg a user override),
+                # so keep it for the whole word
+                nodes.append(ReadingNode(kanji, reading))
+                continue
+
             for definition in regexDefinitions:
                 if definition.regexGroupIndex is None:
                     nodes.append(ReadingNode(definition.text, None))
@@ -276,18 +349,30 @@ class MecabController(object):
                     groupReading = match.group(definition.regexGroupIndex + 1)
                     nodes.append(ReadingNode(definition.text, groupReading))
 
-        # Combine our nodes together into a single sentece
+        # Combine our nodes together into a single sentece. previousCharacter is
+        # the text right before expr, if any, so that bracket notation is
+        # separated from it.
         fin = str()
         for node in nodes:
-            fin += node.format(useRubyTags, fin[-1] if len(fin) > 0 else None)
+            fin += node.format(useRubyTags, fin[-1] if len(fin) > 0 else previousCharacter)
 
         # Finalize formatting
-        fin = fin.replace(ASCII_SPACE_TOKEN, ' ')
         for match in matches:
             fin = fin.replace(HTML_REPLACER, match, 1)
 
-        fin =  re.sub(r'& ?nbsp ?;', ' ', re.sub(r"< ?br ?>", "<br>", re.sub(r"> ", ">", fin.strip())))
-        return fin
+        fin =  re.sub(r'& ?nbsp ?;', ' ', re.sub(r"< ?br ?>", "<br>", re.sub(r"> ", ">", fin)))
+        return (fin, tokens)
+
+    def rangeReading(self, expr, previousCharacter, ignoreNumbers = True, useRubyTags = False):
+        # Whitespace at the edges of a selection belongs to the surrounding text
+        core = expr.strip()
+        if not core:
+            return expr
+
+        lead = expr[:len(expr) - len(expr.lstrip())]
+        trail = expr[len(expr.rstrip()):]
+        html = self.reading(core, ignoreNumbers, useRubyTags, lead[-1] if lead else previousCharacter)
+        return lead + html + trail
 
 # Init
 
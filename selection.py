@@ -30,6 +30,8 @@ ANKI_SEMVER_AS_INT = int(''.join(c for c in version if c.isdigit()))
 class Selection:
 
     selected: Optional[str]
+    isRange: bool = False
+    previousCharacter: Optional[str] = None
     js_get_html = u"""
         var selection = window.getSelection();
         var range = selection.getRangeAt(0);
@@ -37,6 +39,46 @@ class Selection:
         div.appendChild(range.cloneContents());
         div.innerHTML;
     """
+    js_get_range = u"""
+        (function () {
+            let root = document;
+            while (root.activeElement && root.activeElement.shadowRoot) {
+                root = root.activeElement.shadowRoot;
+            }
+            const selection = root.getSelection ? root.getSelection() : window.getSelection();
+            if (!selection || selection.rangeCount === 0 || selection.isCollapsed) {
+                return "";
+            }
+            const range = selection.getRangeAt(0);
+            const div = document.createElement('div');
+            div.appendChild(range.cloneContents());
+
+            // The character right before the range, bracket notation needs it to
+            // know whether the first reading must be separated with a space
+            let editable = range.startContainer;
+            while (editable.parentNode && editable.parentNode.isContentEditable) {
+                editable = editable.parentNode;
+            }
+            const prefix = document.createRange();
+            prefix.setStart(editable, 0);
+            prefix.setEnd(range.startContainer, range.startOffset);
+            const before = prefix.toString();
+
+            return JSON.stringify({html: div.innerHTML, before: before.slice(-1)});
+        })();
+    """
+    js_insert_html = u"document.execCommand('insertHTML', false, %s);"
+    js_set_field = u"""
+        (function () {
+            try {
+                const field = require("anki/NoteEditor").instances[0].fields[%d];
+                field.editingArea.content.set(%s);
+                return true;
+            } catch (e) {
+                return false;
+            }
+        })();
+    """
 
     def __init__(self, window: Editor, callback):
         self.window = window
@@ -61,9 +103,20 @@ class Selection:
             if self.window.note is None:
                 return
 
-            self.setHtml(self.window.note.fields[self.window.currentField], callback, True)
+            self.window.web.evalWithCallback(self.js_get_range, lambda x: self.setRange(x, callback))
             return
 
+    def setRange(self, result: Optional[str], callback) -> None:
+        # Work on the highlighted range only when there is one, otherwise fall
+        # back to the whole current field
+        selection = json.loads(result) if result else None
+        if selection and selection["html"]:
+            self.isRange = True
+            self.previousCharacter = selection["before"] or None
+            self.setHtml(selection["html"], callback, True)
+        elif self.window.currentField is not None and self.window.note is not None:
+            self.setHtml(self.window.note.fields[self.window.currentField], callback, True)
+
     def convertMalformedSpaces(self, text: str) -> str:
         return re.sub(r'& ?nbsp ?;', ' ', text)
 
@@ -74,6 +127,9 @@ class Selection:
             self.window.web.eval("setFormat('insertHTML', %s);" % json.dumps(html))
         elif ANKI_SEMVER_AS_INT < 2150:
             self.window.web.page().runJavaScript("getCurrentField().fieldHTML = %s;" % json.dumps(html))
+        elif self.isRange:
+            # Replace the selection in place, the editor syncs the field back to the note
+            self.window.web.eval(self.js_insert_html % json.dumps(html))
         else:
             if self.window.currentField is None:
                 return
@@ -81,5 +137,14 @@ class Selection:
             if self.window.note is None:
                 return
 
+            # Only push the edited field to the webview instead of reloading the
+            # whole note; older editors without the field API fall back to a reload
             self.window.note.fields[self.window.currentField] = html
+            self.window.web.evalWithCallback(
+                self.js_set_field % (self.window.currentField, json.dumps(html)),
+                self.onFieldUpdated,
+            )
+
+    def onFieldUpdated(self, updated: bool) -> None:
+        if not updated:
             self.window.loadNoteKeepingFocus()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+# Character classification tables, built once at import time so that kana
+# conversion and detection run inside str.translate, sets and compiled regexes
+# instead of calling back into Python for every character.
+
+import re
+
+UNICODE_HIRAGANA_START = 0x3041
+UNICODE_HIRAGANA_END = 0x309F
+UNICODE_KATAKANA_START = 0x30A1
+UNICODE_KATAKANA_END = 0x30FF
+
+UNICODE_MIDDLE_DOT = 0x30FB # '・'
+UNICODE_PROLONGED_SOUND_MARK = 0x30FC # 'ー'
+
+# Regular katakana Unicode block shifted onto the hiragana block, for use with
+# str.translate. Some general punctuation is located within the Katakana block
+# and SHOULDN'T be transformed.
+KATAKANA_TO_HIRAGANA = {
+    code: UNICODE_HIRAGANA_START + (code - UNICODE_KATAKANA_START)
+    for code in range(UNICODE_KATAKANA_START, UNICODE_KATAKANA_END + 1)
+    if code != UNICODE_MIDDLE_DOT and code != UNICODE_PROLONGED_SOUND_MARK
+}
+
+KANA_CLASS = "{}-{}{}-{}".format(
+    chr(UNICODE_HIRAGANA_START), chr(UNICODE_HIRAGANA_END),
+    chr(UNICODE_KATAKANA_START), chr(UNICODE_KATAKANA_END),
+)
+
+KANA_CHARS = frozenset(
+    chr(code) for code in range(UNICODE_HIRAGANA_START, UNICODE_HIRAGANA_END + 1)
+) | frozenset(
+    chr(code) for code in range(UNICODE_KATAKANA_START, UNICODE_KATAKANA_END + 1)
+)
+
+# Splits a word into single kana characters and runs of anything else (kanji)
+KANA_OR_KANJI_RUN = re.compile("[{0}]|[^{0}]+".format(KANA_CLASS))
+
+# Tokens which don't get a reading when numbers are ignored
+NUMBER_CHARS = frozenset(u"一二三四五六七八九十０１２３４５６７８９")
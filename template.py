@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+
+from anki.template import TemplateRenderContext
+
+from . import bulk
+from .cache import ReadingCache, cacheKey
+from .config import config
+from .verify import Verifier
+
+# Anki already ships a `furigana` filter which renders bracket notation, so
+# ours is named after what it does: {{reading:Expression}}
+FILTER_NAME = "reading"
+
+userFilesDir = os.path.join(os.path.dirname(__file__), "user_files")
+os.makedirs(userFilesDir, exist_ok=True)
+
+cache = ReadingCache(
+    os.path.join(userFilesDir, "readings.sqlite"),
+    config.getCacheMemoryEntries(),
+    config.getCacheDiskEntries(),
+)
+
+# Replacements in a card template, eg {{reading:Expression}} or {{text:reading:Expression}}
+TEMPLATE_FIELD = re.compile(r"\{\{([^{}]+)\}\}")
+
+def readingFields(model) -> list[str]:
+    fields = []
+    for tmpl in model["tmpls"]:
+        for replacement in TEMPLATE_FIELD.findall(tmpl["qfmt"] + tmpl["afmt"]):
+            *filters, name = replacement.strip().split(":")
+            if FILTER_NAME in filters and name not in fields:
+                fields.append(name)
+    return fields
+
+def readingKey(text: str) -> str:
+    return cacheKey(text, config.getIgnoreNumbers())
+
+def renderReading(text: str) -> str:
+    # Cards show ruby markup whatever the notation chosen for stored furigana,
+    # since Anki won't run its own furigana filter on our output
+    return bulk.generateFurigana(text, useRubyTags=True)
+
+def cachedReading(text: str) -> str:
+    if not text:
+        return text
+
+    key = readingKey(text)
+    html = cache.get(key)
+    if html is None:
+        generation = cache.generation
+        html = renderReading(text)
+        cache.put(key, html, generation)
+    return html
+
+def onMismatch(text: str, fast: str, reference: str) -> None:
+    cache.put(readingKey(text), reference)
+
+# Checks cached readings against a fresh MeCab run, see Tools > Verify furigana.
+# Mismatches are written next to the cache, where users can find them.
+verifier = Verifier(
+    cachedReading,
+    renderReading,
+    onMismatch=onMismatch,
+    logPath=os.path.join(userFilesDir, "mismatches.log"),
+)
+
+def setVerifying(isEnabled: bool) -> None:
+    verifier.sampleRate = config.getVerifySampleRate() if isEnabled else 0.0
+    verifier.reset()
+
+def invalidate(*args) -> None:
+    cache.clear()
+
+def onFieldFilter(text: str, name: str, filter: str, ctx: TemplateRenderContext) -> str:
+    if filter != FILTER_NAME:
+        return text
+
+    if not text:
+        return text
+
+    return verifier(text)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+# Micro-benchmarks for the character classification helpers that don't need
+# MeCab. Run from the repository root with `python -m test.bench_reading`.
+
+import timeit
+
+import reading
+import tables
+
+from test.legacy import legacyIsKana, legacySplit, legacyTranslator
+
+TEXT = "ポケットモンスター・ダイヤモンドとパールのテレビゲームを勉強する" * 2000
+WORDS = ["口走る", "書き込む", "みじん切り", "ローマ帝国", "ヶ月", "走り抜く", "東京都庁"] * 5000
+
+def bench(name, legacy, current, number=5):
+    before = min(timeit.repeat(legacy, number=number, repeat=3)) / number
+    after = min(timeit.repeat(current, number=number, repeat=3)) / number
+    print("{:<20} {:>10.2f} ms {:>10.2f} ms {:>8.1f}x".format(name, before * 1000, after * 1000, before / after))
+
+if __name__ == "__main__":
+    assert TEXT.translate(legacyTranslator) == reading.convertToHiragana(TEXT)
+    assert [legacySplit(w) for w in WORDS] == [tables.KANA_OR_KANJI_RUN.findall(w) for w in WORDS]
+
+    print("{:<20} {:>13} {:>13} {:>9}".format("", "legacy", "tables", "speedup"))
+    bench("convertToHiragana", lambda: TEXT.translate(legacyTranslator), lambda: reading.convertToHiragana(TEXT))
+    bench("isKana", lambda: [legacyIsKana(c) for c in TEXT], lambda: [reading.isKana(c) for c in TEXT])
+    bench("kana/kanji split", lambda: [legacySplit(w) for w in WORDS], lambda: [tables.KANA_OR_KANJI_RUN.findall(w) for w in WORDS])
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+# Reference implementations replaced by optimized code, kept to check that the
+# replacements give the same results
+
+import os
+import re
+
+from typing import Mapping, Union
+
+import reading
+import tables
+
+# Kana conversion and detection as they were before the precomputed tables
+
+class LegacyTranslator(Mapping[int, Union[str, int, None]]):
+    def __getitem__(self, key: int) -> Union[str, int, None]:
+        if key >= tables.UNICODE_KATAKANA_START and key <= tables.UNICODE_KATAKANA_END:
+            if key == tables.UNICODE_MIDDLE_DOT or key == tables.UNICODE_PROLONGED_SOUND_MARK:
+                raise LookupError()
+            return tables.UNICODE_HIRAGANA_START + (key - tables.UNICODE_KATAKANA_START)
+        raise LookupError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def __iter__(self):
+        raise NotImplementedError()
+
+legacyTranslator = LegacyTranslator()
+
+def legacyIsKana(char: str) -> bool:
+    code = ord(char)
+    if code >= tables.UNICODE_HIRAGANA_START and code <= tables.UNICODE_HIRAGANA_END:
+        return True
+    if code >= tables.UNICODE_KATAKANA_START and code <= tables.UNICODE_KATAKANA_END:
+        return True
+    return False
+
+def legacySplit(kanji: str):
+    pieces = []
+    index = 0
+    while index < len(kanji):
+        if legacyIsKana(kanji[index]):
+            pieces.append(kanji[index])
+            index += 1
+            continue
+        captureGroup = ""
+        while index < len(kanji) and not legacyIsKana(kanji[index]):
+            captureGroup += kanji[index]
+            index += 1
+        pieces.append(captureGroup)
+    return pieces
+
+# MeCab output as it was parsed before byte offsets: space separated
+# surface[reading] nodes, with ASCII spaces swapped for a token beforehand.
+# Everything after parsing matches the current reading().
+
+legacyMecabArgs = ['--node-format=%m[%f[7]] ', '--eos-format=\n',
+                   '--unk-format=%m[] ']
+
+ASCII_SPACE_TOKEN = u"\U0000FFFF"
+
+class LegacyMecabController(reading.MecabController):
+
+    def setup(self):
+        super().setup()
+        self.mecabCmd = reading.mungeForPlatform([os.path.join(reading.mecabDir, "mecab")] + legacyMecabArgs + ['-d', reading.mecabDir, '-r', os.path.join(reading.mecabDir, "mecabrc")])
+
+    def reading(self, expr, ignoreNumbers = True, useRubyTags = False):
+        matches, expr = reading.escapeText(expr)
+        expr = expr.replace(" ", ASCII_SPACE_TOKEN)
+        expr = self.communicate(expr.encode("utf-8", "ignore")).decode('utf-8', "ignore")
+        nodes: list[reading.ReadingNode] = []
+        for node in expr.split(" "):
+            if not node:
+                break
+
+            (kanji, kana) = re.match(r"(.+)\[(.*)\]", node).groups()
+
+            if kanji == kana or not kana:
+                nodes.append(reading.ReadingNode(kanji, None))
+                continue
+
+            kana = reading.convertToHiragana(kana)
+            if kanji == kana:
+                nodes.append(reading.ReadingNode(kanji, None))
+                continue
+
+            if ignoreNumbers and kanji in tables.NUMBER_CHARS:
+                nodes.append(reading.ReadingNode(kanji, None))
+                continue
+
+            (regexPattern, regexDefinitions) = reading.kanjiToRegex(kanji)
+            match = re.search(regexPattern, kana)
+            if match is None:
+                nodes.append(reading.ReadingNode(kanji, kana))
+                continue
+
+            for definition in regexDefinitions:
+                if definition.regexGroupIndex is None:
+                    nodes.append(reading.ReadingNode(definition.text, None))
+                else:
+                    nodes.append(reading.ReadingNode(definition.text, match.group(definition.regexGroupIndex + 1)))
+
+        fin = str()
+        for node in nodes:
+            fin += node.format(useRubyTags, fin[-1] if len(fin) > 0 else None)
+
+        fin = fin.replace(ASCII_SPACE_TOKEN, ' ')
+        for match in matches:
+            fin = fin.replace(reading.HTML_REPLACER, match, 1)
+
+        fin =  re.sub(r'& ?nbsp ?;', ' ', re.sub(r"< ?br ?>", "<br>", re.sub(r"> ", ">", fin.strip())))
+        return fin
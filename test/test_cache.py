@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+import cache
+
+class TestReadingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "readings.sqlite")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    # missing keys should return None
+    def testMiss(self):
+        c = cache.ReadingCache(self.path)
+        self.assertIsNone(c.get("missing"))
+        self.assertFalse(c.contains("missing"))
+        c.close()
+
+    # stored readings should be returned
+    def testHit(self):
+        c = cache.ReadingCache(self.path)
+        c.put("key", "千葉[ちば]")
+        self.assertEqual(c.get("key"), "千葉[ちば]")
+        self.assertTrue(c.contains("key"))
+        c.close()
+
+    # readings should persist between sessions
+    def testPersistent(self):
+        c = cache.ReadingCache(self.path)
+        c.put("key", "千葉[ちば]")
+        c.close()
+
+        c = cache.ReadingCache(self.path)
+        self.assertEqual(c.get("key"), "千葉[ちば]")
+        c.close()
+
+    # the in-memory level should only keep the most recently used entries while
+    # the disk level still serves the evicted ones
+    def testMemoryBounded(self):
+        c = cache.ReadingCache(self.path, memoryEntries=2)
+        c.putMany([("a", "1"), ("b", "2"), ("c", "3")])
+        self.assertEqual(list(c.memory.keys()), ["b", "c"])
+        self.assertEqual(c.get("a"), "1")
+        self.assertEqual(list(c.memory.keys()), ["c", "a"])
+        c.close()
+
+    # the disk level should be pruned down to its bound
+    def testDiskBounded(self):
+        c = cache.ReadingCache(self.path, diskEntries=10)
+        for i in range(25):
+            c.put(str(i), str(i))
+        self.assertLessEqual(len(c), 10)
+        self.assertEqual(c.get("24"), "24")
+        c.close()
+
+    # clearing should drop both levels
+    def testClear(self):
+        c = cache.ReadingCache(self.path)
+        c.put("key", "value")
+        c.clear()
+        self.assertIsNone(c.get("key"))
+        self.assertEqual(len(c), 0)
+        c.close()
+
+    # readings generated before a clear should not be stored after it
+    def testStaleGenerationDropped(self):
+        c = cache.ReadingCache(self.path)
+        generation = c.generation
+        c.clear()
+        c.putMany([("key", "stale")], generation)
+        self.assertIsNone(c.get("key"))
+        c.put("key", "value", c.generation)
+        self.assertEqual(c.get("key"), "value")
+        c.close()
+
+class TestCacheKey(unittest.TestCase):
+    # readings generated with different settings should never share a key
+    def testSettingsInKey(self):
+        self.assertNotEqual(cache.cacheKey("千葉", True), cache.cacheKey("千葉", False))
+
+    # the key should only depend on its inputs
+    def testStable(self):
+        self.assertEqual(cache.cacheKey("千葉", True), cache.cacheKey("千葉", True))
+        self.assertNotEqual(cache.cacheKey("千葉", True), cache.cacheKey("東京", True))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import overrides
+
+class TestOverrideTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = overrides.OverrideTrie({
+            "山田": "やまだ",
+            "山田太郎": "やまだたろう",
+            "東京": "とーきょー",
+        })
+
+    # nodes without overrides should be returned as they are
+    def testNoOverride(self):
+        nodes = [("私", "ワタシ"), ("は", "ハ")]
+        self.assertEqual(list(self.trie.apply(nodes)), nodes)
+
+    # an override spanning several nodes should replace them with a single node
+    def testSpansNodes(self):
+        nodes = [("山", "ヤマ"), ("田", "タ"), ("さん", "サン")]
+        self.assertEqual(list(self.trie.apply(nodes)), [("山田", "やまだ"), ("さん", "サン")])
+
+    # the longest override should win
+    def testLongestMatch(self):
+        nodes = [("山田", "ヤマダ"), ("太郎", "タロウ"), ("です", "デス")]
+        self.assertEqual(list(self.trie.apply(nodes)), [("山田太郎", "やまだたろう"), ("です", "デス")])
+
+    # overrides should only apply on node boundaries
+    def testNodeBoundaries(self):
+        nodes = [("東京都", "トウキョウト")]
+        self.assertEqual(list(self.trie.apply(nodes)), nodes)
+        nodes = [("山田太", "ヤマダタ"), ("郎", "ロウ")]
+        self.assertEqual(list(self.trie.apply(nodes)), [("山田太郎", "やまだたろう")])
+
+    # an empty trie should be falsy and leave nodes untouched
+    def testEmpty(self):
+        trie = overrides.OverrideTrie({})
+        self.assertFalse(trie)
+        self.assertTrue(self.trie)
+        self.assertEqual(list(trie.apply([("山", "ヤマ")])), [("山", "ヤマ")])
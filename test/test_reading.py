@@ -15,6 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
 
+import subprocess
+import sys
+import threading
 import unittest
 
 import reading
@@ -110,6 +113,164 @@ class TestMecab(unittest.TestCase):
         self.assertEqual(reading.mecab.reading("ィヵ"), "ィヵ")
         self.assertEqual(reading.mecab.reading("ゥヶ"), "ゥヶ")
 
+    # user overrides should replace the reading given by MeCab
+    def testOverrides(self):
+        controller = reading.MecabController()
+        controller.setOverrides({"千葉": "せんよう", "自分で": "じぶんで"})
+        self.assertEqual(controller.reading("千葉"), "千葉[せんよう]")
+        self.assertEqual(controller.reading("自分で刈り取れ"), "自分[じぶん]で 刈[か]り 取[と]れ")
+
+class TestParseNodes(unittest.TestCase):
+    # ensure that surfaces are sliced out of the input by their byte offsets
+    def testOffsets(self):
+        expr = "千葉です".encode("utf-8")
+        output = "0\t6\tチバ\t6\t12\tデス\t".encode("utf-8")
+        self.assertEqual(reading.parseNodes(expr, output), [("千葉", "チバ"), ("です", "デス")])
+
+    # ensure that whitespace skipped by MeCab, including ASCII spaces, is kept
+    # as its own node without a reading
+    def testWhitespaceKept(self):
+        expr = " 千葉 \tです  ".encode("utf-8")
+        output = "1\t7\tチバ\t9\t15\tデス\t".encode("utf-8")
+        self.assertEqual(reading.parseNodes(expr, output), [(" ", ""), ("千葉", "チバ"), (" \t", ""), ("です", "デス"), ("  ", "")])
+
+    # ensure that unknown words have an empty reading and that brackets in
+    # surfaces are not mistaken for the reading notation
+    def testUnknownAndBrackets(self):
+        expr = "[a]b".encode("utf-8")
+        output = b"0\t1\t\t1\t2\t\t2\t3\t\t3\t4\t\t"
+        self.assertEqual(reading.parseNodes(expr, output), [("[", ""), ("a", ""), ("]", ""), ("b", "")])
+
+    # ensure that empty output gives no nodes
+    def testEmpty(self):
+        self.assertEqual(reading.parseNodes(b"", b""), [])
+
+    # ensure that output which doesn't describe the input is rejected instead
+    # of producing wrong readings
+    def testRejectsMismatchedOutput(self):
+        expr = "猫".encode("utf-8")
+        for output in ["0\t6\tチバ\t6\t12\tデス\t", "0\t3\tネコ\t0\t3\tネコ\t", "3\t0\tネコ\t", "0\t3\tネコ\t3\t",
+                       "0\t3\tネコ", "a\tb\tネコ\t", "", "input-buffer overflow. The line is split. use -b #SIZE option."]:
+            with self.assertRaises(reading.MecabOutputError):
+                reading.parseNodes(expr, output.encode("utf-8"))
+
+class FixedMecab(reading.MecabController):
+    # Answers with canned MeCab output instead of running MeCab
+    def __init__(self, outputs):
+        super().__init__()
+        self.outputs = outputs
+
+    def communicate(self, line, parse=None):
+        output = self.outputs[line.decode("utf-8")].encode("utf-8")
+        return output if parse is None else parse(output)
+
+class TestRangeReading(unittest.TestCase):
+
+    def setUp(self):
+        self.mecab = FixedMecab({"名前": "0\t6\tナマエ\t", "名前です": "0\t6\tナマエ\t6\t12\tデス\t"})
+
+    # a selection starting with a kanji right after other text should have its
+    # reading separated from that text in bracket notation
+    def testSeparatedFromPreviousText(self):
+        self.assertEqual(self.mecab.rangeReading("名前", "の"), " 名前[なまえ]")
+        self.assertEqual(self.mecab.rangeReading("名前です", "の"), " 名前[なまえ]です")
+
+    # no separator is needed at the start of a field, after another reading or
+    # with ruby tags
+    def testNoSeparatorNeeded(self):
+        self.assertEqual(self.mecab.rangeReading("名前", None), "名前[なまえ]")
+        self.assertEqual(self.mecab.rangeReading("名前", "]"), "名前[なまえ]")
+        self.assertEqual(self.mecab.rangeReading("名前", "の", useRubyTags=True), "<ruby>名前<rp>(</rp><rt>なまえ</rt><rp>)</rp></ruby>")
+
+    # whitespace at the edges of the selection should be kept
+    def testEdgeWhitespaceKept(self):
+        self.assertEqual(self.mecab.rangeReading(" 名前 ", "の"), "  名前[なまえ] ")
+        self.assertEqual(self.mecab.rangeReading("名前　", None), "名前[なまえ]　")
+        self.assertEqual(self.mecab.rangeReading("  ", "の"), "  ")
+
+    # whole fields should still have their edge whitespace trimmed
+    def testFieldTrimmed(self):
+        self.assertEqual(self.mecab.reading(" 名前 "), "名前[なまえ]")
+
+class TestSetOverrides(unittest.TestCase):
+    # ensure that callers are told whether the overrides changed, so that
+    # cached readings are only dropped when needed
+    def testReportsChanges(self):
+        controller = FixedMecab({"千葉": "0\t6\tチバ\t"})
+        self.assertFalse(controller.setOverrides({}))
+        self.assertTrue(controller.setOverrides({"千葉": "せんよう"}))
+        self.assertFalse(controller.setOverrides({"千葉": "せんよう"}))
+        self.assertEqual(controller.reading("千葉"), "千葉[せんよう]")
+        self.assertTrue(controller.setOverrides({}))
+        self.assertEqual(controller.reading("千葉"), "千葉[ちば]")
+
+class TestMecabMultiplexing(unittest.TestCase):
+    # ensure that concurrent callers sharing one engine each get back the output
+    # for their own line. `cat` stands in for MeCab as it answers lines in order.
+    @unittest.skipIf(sys.platform.startswith("win32"), "requires cat")
+    def testConcurrentCallers(self):
+        controller = reading.MecabController()
+        controller.mecab = subprocess.Popen(["cat"], bufsize=-1, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        results = {}
+
+        def worker(n):
+            for i in range(200):
+                line = "{}-{}".format(n, i).encode() * (i % 7 + 1)
+                results[(n, i)] = controller.communicate(line) == line
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        controller.mecab.stdin.close()
+        controller.mecab.stdout.close()
+        controller.mecab.wait()
+        self.assertEqual(len(results), 8 * 200)
+        self.assertTrue(all(results.values()))
+        self.assertEqual(len(controller.pending), 0)
+
+# Answers every line with a single node spanning the whole line, after first
+# writing a warning line when started with an argument
+FAKE_MECAB = """
+import sys
+if len(sys.argv) > 1:
+    sys.stdout.buffer.write(b"input-buffer overflow. The line is split.\\n")
+for line in sys.stdin.buffer:
+    sys.stdout.buffer.write(b"0\\t%d\\t\\xe3\\x83\\x8d\\xe3\\x82\\xb3\\t\\n" % len(line.rstrip(b"\\n")))
+    sys.stdout.buffer.flush()
+"""
+
+class FakeMecab(reading.MecabController):
+    # Runs FAKE_MECAB instead of MeCab
+    def setup(self):
+        self.mecabCmd = [sys.executable, "-u", "-c", FAKE_MECAB]
+
+class TestMecabRestart(unittest.TestCase):
+    # ensure that an engine whose answers are out of step is replaced instead of
+    # its answers being handed to the wrong callers
+    def testRestartsOnMismatchedOutput(self):
+        controller = FakeMecab()
+        broken = subprocess.Popen([sys.executable, "-u", "-c", FAKE_MECAB, "warn"], bufsize=-1, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        controller.mecab = broken
+        self.assertEqual(controller.reading("猫"), "猫[ねこ]")
+        self.assertEqual(controller.reading("猫"), "猫[ねこ]")
+        self.assertIsNot(controller.mecab, broken)
+        self.assertIsNotNone(broken.poll())
+        broken.stdout.close()
+
+        controller.mecab.stdin.close()
+        controller.mecab.stdout.close()
+        controller.mecab.wait()
+
+    # ensure that lines MeCab would split are refused before they are written
+    def testRefusesLongLines(self):
+        controller = FakeMecab()
+        with self.assertRaises(ValueError):
+            controller.communicate(b"a" * reading.MECAB_BUFFER_SIZE)
+        self.assertIsNone(controller.mecab)
+
 class TestConvertToHiragana(unittest.TestCase):
     # ensure that if the function is called with an empty string, it will return
     # an empty string
@@ -176,3 +337,37 @@ class TestConvertToHiragana(unittest.TestCase):
         self.assertEqual(reading.convertToHiragana("ツィッター"), "つぃったー")
         self.assertEqual(reading.convertToHiragana("ぁぃぅぇぉ"), "ぁぃぅぇぉ")
         self.assertEqual(reading.convertToHiragana("ァィゥェォ"), "ぁぃぅぇぉ")
+
+class TestIsKana(unittest.TestCase):
+    # ensure that both hiragana and katakana, including small kana and the
+    # punctuation living in the katakana block, are detected as kana
+    def testKana(self):
+        for char in "あんぁゔゟアンァヶ・ーヿ":
+            self.assertTrue(reading.isKana(char), char)
+
+    # ensure that kanji, half-width katakana and other characters are not kana
+    def testNotKana(self):
+        for char in "日本語ｱ。a ２一":
+            self.assertFalse(reading.isKana(char), char)
+
+class TestKanjiToRegex(unittest.TestCase):
+    # ensure that runs of kanji become a single capture group and kana is inlined
+    # as hiragana
+    def testKanaBetweenKanji(self):
+        (pattern, definitions) = reading.kanjiToRegex("書き込む")
+        self.assertEqual(pattern, "^(.+?)き(.+?)む$")
+        self.assertEqual([d.text for d in definitions], ["書", "き", "込", "む"])
+        self.assertEqual([d.regexGroupIndex for d in definitions], [0, None, 1, None])
+
+    # ensure that katakana is matched against the hiragana reading but kept as is
+    # in the definitions
+    def testKatakanaPrefix(self):
+        (pattern, definitions) = reading.kanjiToRegex("ローマ帝国")
+        self.assertEqual(pattern, "^ろーま(.+?)$")
+        self.assertEqual([d.text for d in definitions], ["ロ", "ー", "マ", "帝国"])
+
+    # ensure that kana with additional possible readings get their own group
+    def testAdditionalReadings(self):
+        (pattern, definitions) = reading.kanjiToRegex("ヶ月")
+        self.assertEqual(pattern, "^(ゖ|か)(.+?)$")
+        self.assertEqual([d.regexGroupIndex for d in definitions], [0, 1])
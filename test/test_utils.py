@@ -49,3 +49,29 @@ class TestRemoveFurigana(unittest.TestCase):
     # (which also ensures that we're decoupled from the user's current config selection)
     def testRemovesBothNotations(self):
         self.assertEqual(utils.removeFurigana("<ruby>日本語<rp>(</rp><rt>にほんご</rt><rp>)</rp></ruby>を勉強[べんきょう]する"), "日本語を勉強する")
+
+    # ensure that fields with an audio tag and no furigana come back unchanged
+    def testPreservesSoundTags(self):
+        self.assertEqual(utils.removeFurigana("no furigana here [sound:a.mp3]"), "no furigana here [sound:a.mp3]")
+        self.assertEqual(utils.removeFurigana("音声[sound:a.mp3]"), "音声[sound:a.mp3]")
+
+    # ensure that only the spaces belonging to the bracket notation are removed
+    def testPreservesUnrelatedSpaces(self):
+        self.assertEqual(utils.removeFurigana("A: 勉強[べんきょう]する [sound:a.mp3]"), "A:勉強する [sound:a.mp3]")
+
+class TestFormatDuration(unittest.TestCase):
+
+    # durations under a minute should be shown in seconds
+    def testSeconds(self):
+        self.assertEqual(utils.formatDuration(0), "0s")
+        self.assertEqual(utils.formatDuration(42.4), "42s")
+
+    # durations under an hour should be shown in minutes and seconds
+    def testMinutes(self):
+        self.assertEqual(utils.formatDuration(60), "1m 00s")
+        self.assertEqual(utils.formatDuration(395), "6m 35s")
+
+    # longer durations should be shown in hours and minutes
+    def testHours(self):
+        self.assertEqual(utils.formatDuration(3600), "1h 00m")
+        self.assertEqual(utils.formatDuration(3 * 3600 + 25 * 60 + 10), "3h 25m")
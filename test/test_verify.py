@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import random
+import tempfile
+import unittest
+
+import cache
+import reading
+import verify
+
+from test.legacy import LegacyMecabController, legacyIsKana, legacyTranslator
+
+# Hiragana, katakana (including its punctuation), kanji, ASCII and full-width
+# characters
+CHARACTERS = [(0x3041, 0x309F), (0x30A1, 0x30FF), (0x4E00, 0x4FFF), (0x20, 0x7E), (0xFF01, 0xFF9F)]
+
+# Text both MeCab parsers are expected to agree on: no brackets (the old parser
+# misread them) and no HTML
+JAPANESE_TEXT = [(0x3041, 0x3096), (0x30A1, 0x30FA), (0x4E00, 0x4FFF), (0x61, 0x7A), (0x20, 0x20), (0xFF10, 0xFF19)]
+
+def generateCorpus(size, seed=0, ranges=CHARACTERS):
+    # Random strings made of characters from the given code point ranges
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        chars = []
+        for _ in range(rng.randint(0, 40)):
+            (start, end) = rng.choice(ranges)
+            chars.append(chr(rng.randint(start, end)))
+        corpus.append("".join(chars))
+    return corpus
+
+class TestVerifier(unittest.TestCase):
+
+    # without sampling only the fast path should run
+    def testDisabled(self):
+        calls = []
+        verifier = verify.Verifier(str.upper, lambda text: calls.append(text) or text.upper())
+        self.assertEqual(verifier("abc"), "ABC")
+        self.assertEqual(calls, [])
+        self.assertEqual((verifier.calls, verifier.sampled), (1, 0))
+
+    # sampled calls should run both paths and agree
+    def testMatch(self):
+        verifier = verify.Verifier(str.upper, str.upper, sampleRate=1.0)
+        for text in ["a", "b", "c"]:
+            self.assertEqual(verifier(text), text.upper())
+        self.assertEqual((verifier.calls, verifier.sampled, verifier.mismatches), (3, 3, 0))
+        self.assertIsNotNone(verifier.speedup())
+
+    # mismatches should be logged with the input, reported and the reference
+    # result returned instead of the fast one
+    def testMismatch(self):
+        mismatches = []
+        verifier = verify.Verifier(str.lower, str.upper, sampleRate=1.0, onMismatch=lambda *args: mismatches.append(args))
+        with self.assertLogs(verify.logger, logging.WARNING) as logs:
+            self.assertEqual(verifier("Abc"), "ABC")
+        self.assertIn("'Abc'", logs.output[0])
+        self.assertEqual(mismatches, [("Abc", "abc", "ABC")])
+        self.assertEqual(verifier.mismatches, 1)
+        self.assertIn("1 mismatch", verifier.report())
+
+    # mismatches should be appended to the log file named in the report
+    def testMismatchLogFile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "mismatches.log")
+            verifier = verify.Verifier(str.lower, str.upper, sampleRate=1.0, logPath=path)
+            with self.assertLogs(verify.logger, logging.WARNING):
+                verifier("Abc")
+                verifier("Def")
+            with open(path, encoding="utf-8") as log:
+                lines = log.read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertIn("input: 'Abc'\tgot: 'abc'\texpected: 'ABC'", lines[0])
+            self.assertIn(path, verifier.report())
+
+    # sampling should be reproducible with a seeded generator
+    def testSeededSampling(self):
+        sampled = []
+        for _ in range(2):
+            verifier = verify.Verifier(str.upper, str.upper, sampleRate=0.3, rng=random.Random(42))
+            for text in "abcdefghijklmnopqrstuvwxyz":
+                verifier(text)
+            sampled.append(verifier.sampled)
+        self.assertEqual(sampled[0], sampled[1])
+        self.assertGreater(sampled[0], 0)
+        self.assertLess(sampled[0], 26)
+
+    # resetting should drop the statistics
+    def testReset(self):
+        verifier = verify.Verifier(str.upper, str.upper, sampleRate=1.0)
+        verifier("a")
+        verifier.reset()
+        self.assertEqual((verifier.calls, verifier.sampled, verifier.speedup()), (0, 0, None))
+
+class TestCorpus(unittest.TestCase):
+
+    # the precomputed tables should give the same results as the per-character
+    # implementations they replaced over a large generated corpus
+    def testConvertToHiragana(self):
+        verifier = verify.Verifier(reading.convertToHiragana, lambda text: text.translate(legacyTranslator), sampleRate=1.0)
+        for text in generateCorpus(20000):
+            verifier(text)
+        self.assertEqual(verifier.mismatches, 0, verifier.report())
+
+    def testIsKana(self):
+        verifier = verify.Verifier(
+            lambda text: "".join("1" if reading.isKana(c) else "0" for c in text),
+            lambda text: "".join("1" if legacyIsKana(c) else "0" for c in text),
+            sampleRate=1.0,
+        )
+        for text in generateCorpus(20000, seed=1):
+            verifier(text)
+        self.assertEqual(verifier.mismatches, 0, verifier.report())
+
+    # readings served through the cache with the byte offset parser should match
+    # the space separated parser it replaced over a large generated corpus
+    def testCachedReading(self):
+        readings = cache.ReadingCache()
+
+        def cachedReading(text):
+            key = cache.cacheKey(text, True)
+            html = readings.get(key)
+            if html is None:
+                html = reading.mecab.reading(text)
+                readings.put(key, html)
+            return html
+
+        legacy = LegacyMecabController()
+        verifier = verify.Verifier(cachedReading, legacy.reading, sampleRate=0.5, rng=random.Random(0))
+
+        # Every string twice so that cache hits are verified as well
+        corpus = generateCorpus(5000, seed=2, ranges=JAPANESE_TEXT) * 2
+        for text in corpus:
+            verifier(text)
+
+        self.assertGreater(verifier.sampled, 0)
+        self.assertEqual(verifier.mismatches, 0, verifier.report())
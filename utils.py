@@ -17,6 +17,8 @@
 
 import re
 
+BRACKET_READING = re.compile(r" ?([^ >\[\]]+?)\[[^\[\]:]*\]")
+
 def removeFurigana(text: str):
     stripped = text
 
@@ -34,12 +36,22 @@ def removeFurigana(text: str):
         # they aren't included in the original regex response
         stripped = stripped.replace("<ruby>" + ruby + "</ruby>", body)
 
-    # Next, remove the bracket notation
-    # remove spaces only if bracket notation was used
-    if "[" in stripped:
-        stripped = stripped.replace(" ", "")
-
-    stripped, _ = re.subn('\[[^\]]*\]', '', stripped)
+    # Next, remove the bracket notation, along with the space that may separate
+    # a base word from the text before it. Brackets that don't follow a base word
+    # or that contain a colon, like [sound:a.mp3], aren't readings and are kept
+    stripped = BRACKET_READING.sub(r"\1", stripped)
 
     # Return the final string
     return stripped
+
+def formatDuration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "{}s".format(seconds)
+
+    (minutes, seconds) = divmod(seconds, 60)
+    if minutes < 60:
+        return "{}m {:02d}s".format(minutes, seconds)
+
+    (hours, minutes) = divmod(minutes, 60)
+    return "{}h {:02d}m".format(hours, minutes)
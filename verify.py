@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Japanese Furigana <https://github.com/obynio/anki-japanese-furigana>.
+#
+# Japanese Furigana is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Japanese Furigana is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Japanese Furigana.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import random
+import threading
+import time
+
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Runs a sampled fraction of calls through both an optimized path and the
+# reference implementation it replaces. Mismatches are logged with their input,
+# and appended to logPath when given, and the reference result is returned, so
+# sampled calls never drift.
+class Verifier:
+
+    def __init__(
+        self,
+        fast: Callable[[str], str],
+        reference: Callable[[str], str],
+        sampleRate: float = 0.0,
+        onMismatch: Optional[Callable[[str, str, str], None]] = None,
+        rng: Optional[random.Random] = None,
+        logPath: Optional[str] = None,
+    ):
+        self.fast = fast
+        self.reference = reference
+        self.sampleRate = sampleRate
+        self.onMismatch = onMismatch
+        self.logPath = logPath
+        # Pass a seeded generator to make sampling reproducible
+        self.rng = rng if rng is not None else random.Random()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.calls = 0
+            self.sampled = 0
+            self.mismatches = 0
+            self.fastTime = 0.0
+            self.referenceTime = 0.0
+
+    def __call__(self, text: str) -> str:
+        with self.lock:
+            self.calls += 1
+
+        if self.sampleRate <= 0 or self.rng.random() >= self.sampleRate:
+            return self.fast(text)
+
+        start = time.perf_counter()
+        fast = self.fast(text)
+        middle = time.perf_counter()
+        reference = self.reference(text)
+        end = time.perf_counter()
+
+        with self.lock:
+            self.sampled += 1
+            self.fastTime += middle - start
+            self.referenceTime += end - middle
+            if fast != reference:
+                self.mismatches += 1
+
+        if fast == reference:
+            return fast
+
+        logger.warning("Fast path mismatch for %r: got %r, expected %r", text, fast, reference)
+        if self.logPath:
+            with self.lock:
+                with open(self.logPath, "a", encoding="utf-8") as log:
+                    log.write("{}\tinput: {!r}\tgot: {!r}\texpected: {!r}\n".format(
+                        time.strftime("%Y-%m-%d %H:%M:%S"), text, fast, reference))
+        if self.onMismatch:
+            self.onMismatch(text, fast, reference)
+        return reference
+
+    def speedup(self) -> Optional[float]:
+        if self.sampled == 0 or self.fastTime == 0:
+            return None
+        return self.referenceTime / self.fastTime
+
+    def report(self) -> str:
+        speedup = self.speedup()
+        return "{} of {} calls verified, {} mismatch(es){}{}".format(
+            self.sampled,
+            self.calls,
+            self.mismatches,
+            ", fast path {:.1f}x faster".format(speedup) if speedup else "",
+            ", see {}".format(self.logPath) if self.mismatches and self.logPath else "",
+        )